@@ -1,14 +1,27 @@
+import asyncio
+import json
+import logging
 import os
-import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 from fastapi.staticfiles import StaticFiles
 from pathlib import Path
 
-from vosk_service import VoskService
+try:
+    import orjson
+
+    orjson_available = True
+except ImportError:
+    orjson_available = False
+
+from vosk_service import VoskService, BatchedDecoder, batch_available, split_audio_message, trim_silence
 from weather_service import WeatherService
 from extractorService import WeatherExtractor
 
+log = logging.getLogger(__name__)
+
 app = FastAPI()
 
 app.add_middleware(
@@ -18,6 +31,8 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Websocket frames are already compressed by uvicorn (ws_per_message_deflate defaults to on)
+app.add_middleware(GZipMiddleware, minimum_size=500)
 
 if Path("tts_recordings").exists():
     app.mount("/tts_recordings", StaticFiles(directory="tts_recordings"), name="frontend")
@@ -26,32 +41,231 @@ vosk_service = VoskService()
 weather_extractor = WeatherExtractor()
 weather_service = WeatherService()
 
+# Weather queries use a small closed vocabulary; decoding against it is much faster
+# but unknown place names come out as [unk], so it stays opt-in
+if os.environ.get("GRAMMAR") == "1":
+    vosk_service.set_grammar(weather_extractor.vocabulary())
+
+# Opt-in GPU batch decoding shared by all connections (needs a GPU Vosk build).
+# Created per worker on startup because CUDA state does not survive a fork.
+batch_decoder = None
+
+
+@app.on_event("startup")
+async def start_batch_decoder():
+    global batch_decoder
+    if os.environ.get("VOSK_BATCH") == "1" and batch_available and vosk_service.is_available():
+        batch_decoder = BatchedDecoder(vosk_service.model_path)
+        app.state.batch_task = asyncio.create_task(batch_decoder.run())
+
+
+# Vosk decodes one utterance on one thread and releases the GIL, so a process needs
+# one decode thread per core it should use. Under gunicorn the cores are already
+# split across WEB_CONCURRENCY worker processes; a single uvicorn process gets them all.
+# A dedicated pool keeps decoding from competing with other to_thread users.
+DECODE_THREADS = int(os.environ.get(
+    "DECODE_THREADS", max(1, (os.cpu_count() or 1) // int(os.environ.get("WEB_CONCURRENCY", "1")))))
+decode_executor = ThreadPoolExecutor(max_workers=DECODE_THREADS)
+
+
+async def run_decode(func, *args):
+    return await asyncio.get_running_loop().run_in_executor(decode_executor, func, *args)
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    batch_task = getattr(app.state, "batch_task", None)
+    if batch_task is not None:
+        batch_task.cancel()
+    await weather_service.aclose()
+    decode_executor.shutdown(wait=False)
+
+
+# Websocket connections served at once per worker; further clients get 1013
+MAX_CONNECTIONS = int(os.environ.get("MAX_CONNECTIONS", "100"))
+
+# Queue marker standing in for the latest pending partial transcript
+_PARTIAL = object()
+
 
 class ConnectionManager:
-    def __init__(self):
-        self.active_connections = []
+    def __init__(self, max_connections=MAX_CONNECTIONS):
+        # websocket -> cached recognizer state {"rec": KaldiRecognizer, "rate": int}
+        self.active_connections = {}
+        self.max_connections = max_connections
 
     async def connect(self, websocket):
+        # No TCP_NODELAY tweak needed: asyncio and uvloop transports already disable
+        # Nagle on every accepted socket, and ASGI does not expose the socket anyway
         await websocket.accept()
-        self.active_connections.append(websocket)
+        if len(self.active_connections) >= self.max_connections:
+            # 1013 = try again later
+            await websocket.close(code=1013)
+            return False
+        state = {"rec": None, "rate": None, "outbox": asyncio.Queue(maxsize=32), "partial": None}
+        state["writer"] = asyncio.create_task(self._writer(websocket, state))
+        self.active_connections[websocket] = state
+        return True
 
     def disconnect(self, websocket):
-        self.active_connections.remove(websocket)
+        # Idempotent: may run from several exception paths for the same socket
+        state = self.active_connections.pop(websocket, None)
+        if state is not None:
+            state["writer"].cancel()
 
     async def send_message(self, message, websocket):
-        await websocket.send_json(message)
+        # Queue for the connection's writer task so a slow client never stalls decoding
+        state = self.active_connections.get(websocket)
+        if state is None:
+            # Never connected or already dropped: the socket is closed or closing
+            return
+
+        if message.get("type") == "partial":
+            # Partials supersede each other: keep only the newest until the writer sends it
+            queued = state["partial"] is not None
+            state["partial"] = message
+            if not queued and not state["outbox"].full():
+                state["outbox"].put_nowait(_PARTIAL)
+            elif not queued:
+                state["partial"] = None
+            return
+
+        if state["writer"].done() or state["outbox"].full():
+            # Dead writer or a client that stopped reading: nothing will drain the
+            # outbox any more, so free the slot instead of waiting on it forever
+            await self._drop(websocket, 1013)
+            raise WebSocketDisconnect(1013)
+        state["outbox"].put_nowait(message)
+
+    async def _drop(self, websocket, code):
+        self.disconnect(websocket)
+        try:
+            await websocket.close(code=code)
+        except Exception:
+            pass
+
+    async def _writer(self, websocket, state):
+        outbox = state["outbox"]
+        try:
+            while True:
+                message = await outbox.get()
+                if message is _PARTIAL:
+                    message, state["partial"] = state["partial"], None
+                await self._send(message, websocket)
+        except Exception:
+            # Client went away; release the connection so later sends fail fast
+            self.disconnect(websocket)
+
+    async def _send(self, message, websocket):
+        if orjson_available:
+            # Still a text frame so browser clients can JSON.parse it as before
+            await websocket.send_text(orjson.dumps(message).decode())
+        else:
+            await websocket.send_json(message)
 
 
 manager = ConnectionManager()
 
 
+async def transcribe_with_partials(rate, pcm, websocket):
+    """Decode chunk by chunk in a worker thread, pushing partial hypotheses to the client"""
+    try:
+        events = vosk_service.iter_pcm_transcription(rate, pcm, manager.active_connections[websocket])
+
+        while True:
+            event = await run_decode(next, events, None)
+            if event is None or event["type"] == "final":
+                return {"success": True, "text": event["text"] if event else ""}
+            await manager.send_message(event, websocket)
+    except WebSocketDisconnect:
+        raise
+    except Exception as e:
+        return {"success": False, "error": str(e)}
+
+
+async def receive_loop(websocket, inbox):
+    """Keep reading the socket while a message is being processed.
+
+    Starlette allows only one reader per websocket, so a single task drains it
+    into a bounded queue; a slow decode then backpressures the client instead
+    of leaving frames unread.
+    """
+    try:
+        while True:
+            message = await websocket.receive()
+            await inbox.put(message)
+            if message["type"] == "websocket.disconnect":
+                return
+    except Exception:
+        # Protocol error or receive after close: end the handler instead of
+        # leaving it waiting on an inbox nobody fills
+        await inbox.put({"type": "websocket.disconnect", "code": 1011})
+
+
+async def answer_query(text, websocket):
+    """Run the rule based extractor and weather lookup for a transcribed or typed query"""
+    weather_data = weather_extractor.extract(text)
+    weather_data["original_query"] = text
+
+    # Get weather data directly from the service
+    weather_response = await weather_service.get_weather(weather_data)
+
+    if weather_response["success"]:
+        response_text = weather_response["data"].get("response", "Keine Wetterinformationen verfügbar")
+    else:
+        response_text = f"Fehler: {weather_response.get('message', 'Unbekannter Fehler')}"
+
+    result_text = f"{text}\n\nWetterabfrage: {weather_data.get('is_weather_query')}\nOrt: {weather_data.get('location', 'nicht erkannt')}\nZeitraum: {weather_data.get('time_period', 'heute')}\n\nAntwort: {response_text}"
+
+    await manager.send_message(
+        {"type": "transcription", "text": result_text},
+        websocket
+    )
+
+
+async def answer_transcription(transcribed_text, websocket):
+    await manager.send_message(
+        {"type": "transcription", "text": transcribed_text},
+        websocket
+    )
+
+    if not transcribed_text:
+        await manager.send_message(
+            {"type": "transcription", "text": "Keine Sprache erkannt."},
+            websocket
+        )
+        return
+
+    await answer_query(transcribed_text, websocket)
+
+
+def parse_control(text):
+    # Streaming control messages: {"type": "start", "sample_rate": 16000} / {"type": "end"}
+    if not text.startswith("{"):
+        return None
+    try:
+        message = orjson.loads(text) if orjson_available else json.loads(text)
+    except ValueError:
+        return None
+    if isinstance(message, dict) and message.get("type") in ("start", "end"):
+        return message
+    return None
+
+
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
-    await manager.connect(websocket)
+    if not await manager.connect(websocket):
+        return
+
+    session = manager.active_connections[websocket]
+    inbox = asyncio.Queue(maxsize=32)
+    reader = asyncio.create_task(receive_loop(websocket, inbox))
 
     try:
         while True:
-            data = await websocket.receive()
+            data = await inbox.get()
+            if data["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(data.get("code", 1000))
 
             if "bytes" in data:
                 if not vosk_service.is_available():
@@ -62,86 +276,69 @@ async def websocket_endpoint(websocket: WebSocket):
                     continue
 
                 audio_data = data["bytes"]
-                temp_file_path = None
 
                 try:
-                    with tempfile.NamedTemporaryFile(delete=False, suffix='.wav') as temp_file:
-                        temp_file_path = temp_file.name
-                        temp_file.write(audio_data)
+                    if session.get("streaming"):
+                        # Live stream: every message is a raw PCM chunk for the open recognizer
+                        event = await run_decode(vosk_service.accept_chunk, audio_data, session)
+                        await manager.send_message(event, websocket)
+                        continue
 
-                    transcription_result = vosk_service.transcribe_audio(temp_file_path)
+                    rate, pcm = split_audio_message(audio_data)
 
-                    if not transcription_result["success"]:
-                        await manager.send_message(
-                            {"type": "error", "message": transcription_result["error"]},
-                            websocket
-                        )
+                    # Silence or background noise only: skip the decode altogether
+                    pcm = await run_decode(trim_silence, rate, pcm)
+                    if pcm is None:
+                        await answer_transcription("", websocket)
                         continue
 
-                    transcribed_text = transcription_result["text"]
-
-                    await manager.send_message(
-                        {"type": "transcription", "text": transcribed_text},
-                        websocket
-                    )
+                    if batch_decoder is not None:
+                        transcription_result = await batch_decoder.transcribe(rate, pcm)
+                    else:
+                        transcription_result = await transcribe_with_partials(rate, pcm, websocket)
 
-                    if not transcribed_text:
+                    if not transcription_result["success"]:
                         await manager.send_message(
-                            {"type": "transcription", "text": "Keine Sprache erkannt."},
+                            {"type": "error", "message": transcription_result["error"]},
                             websocket
                         )
                         continue
 
-                    # Use rule based extractor
-                    weather_data = weather_extractor.extract(transcribed_text)
-                    weather_data["original_query"] = transcribed_text
-
-                    # Get weather data directly from the service
-                    weather_response = weather_service.get_weather(weather_data)
-
-                    if weather_response["success"]:
-                        response_text = weather_response["data"].get("response", "Keine Wetterinformationen verfügbar")
-                    else:
-                        response_text = f"Fehler: {weather_response.get('message', 'Unbekannter Fehler')}"
-
-                    result_text = f"{transcribed_text}\n\nWetterabfrage: {weather_data.get('is_weather_query')}\nOrt: {weather_data.get('location', 'nicht erkannt')}\nZeitraum: {weather_data.get('time_period', 'heute')}\n\nAntwort: {response_text}"
-
-                    await manager.send_message(
-                        {"type": "transcription", "text": result_text},
-                        websocket
-                    )
+                    await answer_transcription(transcription_result["text"], websocket)
 
+                except WebSocketDisconnect:
+                    raise
                 except Exception as e:
                     await manager.send_message(
                         {"type": "error", "message": f"Error: {str(e)}"},
                         websocket
                     )
-                finally:
-                    if temp_file_path and os.path.exists(temp_file_path):
-                        os.unlink(temp_file_path)
 
             elif "text" in data:
-                # Handle text input directly (for testing without audio) --> debug
                 try:
-                    text_query = data["text"]
-                    weather_data = weather_extractor.extract(text_query)
-                    weather_data["original_query"] = text_query
+                    control = parse_control(data["text"])
+
+                    if control is not None and control["type"] == "start":
+                        if not vosk_service.is_available():
+                            await manager.send_message(
+                                {"type": "error", "message": "Speech recognition not available"},
+                                websocket
+                            )
+                            continue
+                        rate = int(control.get("sample_rate", 16000))
+                        await run_decode(vosk_service.start_stream, rate, session)
+
+                    elif control is not None and control["type"] == "end":
+                        if session.get("streaming"):
+                            transcribed_text = await run_decode(vosk_service.finish_stream, session)
+                            await answer_transcription(transcribed_text, websocket)
 
-                    # Get weather data directly from the service
-                    weather_response = weather_service.get_weather(weather_data)
-
-                    if weather_response["success"]:
-                        response_text = weather_response["data"].get("response", "Keine Wetterinformationen verfügbar")
                     else:
-                        response_text = f"Fehler: {weather_response.get('message', 'Unbekannter Fehler')}"
-
-                    result_text = f"{text_query}\n\nWetterabfrage: {weather_data.get('is_weather_query')}\nOrt: {weather_data.get('location', 'nicht erkannt')}\nZeitraum: {weather_data.get('time_period', 'heute')}\n\nAntwort: {response_text}"
-
-                    await manager.send_message(
-                        {"type": "transcription", "text": result_text},
-                        websocket
-                    )
+                        # Handle text input directly (for testing without audio) --> debug
+                        await answer_query(data["text"], websocket)
 
+                except WebSocketDisconnect:
+                    raise
                 except Exception as e:
                     await manager.send_message(
                         {"type": "error", "message": f"Error: {str(e)}"},
@@ -152,6 +349,12 @@ async def websocket_endpoint(websocket: WebSocket):
         manager.disconnect(websocket)
     except Exception:
         manager.disconnect(websocket)
+        try:
+            await websocket.close(code=1011)
+        except Exception:
+            pass
+    finally:
+        reader.cancel()
 
 
 @app.get("/")
@@ -159,15 +362,20 @@ async def root():
     return {"message": "Voice Weather API is running"}
 
 
+@app.get("/cache-stats")
+async def cache_stats():
+    return {**weather_service.stats, "size": len(weather_service.cache)}
+
+
 @app.websocket("/weather")
 async def weather_websocket_endpoint(websocket: WebSocket):
     await websocket.accept()
-    print("Weather WebSocket client connected")
+    log.info("Weather WebSocket client connected")
 
     try:
         while True:
             data = await websocket.receive_json()
-            print(f"Received weather request: {data}")
+            log.debug("Received weather request: %s", data)
 
             try:
                 if data.get("type") == "get_weather":
@@ -181,7 +389,7 @@ async def weather_websocket_endpoint(websocket: WebSocket):
                     }
 
                     # Get weather data directly
-                    weather_response = weather_service.get_weather(weather_data)
+                    weather_response = await weather_service.get_weather(weather_data)
 
                     if weather_response["success"]:
                         await websocket.send_json({
@@ -199,12 +407,12 @@ async def weather_websocket_endpoint(websocket: WebSocket):
                         "message": "Unknown request type"
                     })
             except Exception as e:
-                print(f"Error processing weather request: {e}")
+                log.error("Error processing weather request: %s", e)
                 await websocket.send_json({
                     "type": "error",
                     "message": f"Server error: {str(e)}"
                 })
     except WebSocketDisconnect:
-        print("Weather WebSocket client disconnected")
+        log.info("Weather WebSocket client disconnected")
     except Exception as e:
-        print(f"Unexpected error in weather WebSocket: {e}")
+        log.error("Unexpected error in weather WebSocket: %s", e)
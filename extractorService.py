@@ -1,68 +1,96 @@
 import re
 
+try:
+    import ahocorasick
+
+    ahocorasick_available = True
+except ImportError:
+    ahocorasick_available = False
+
+# Muster: "Wetter [Stadt]"
+WETTER_CITY_PATTERN = re.compile(r'wetter\s+([a-zäöüß]+)')
+
+
+def _keyword_scanner(words):
+    """Returns a function yielding every keyword occurrence in one pass over the text."""
+    if ahocorasick_available:
+        automaton = ahocorasick.Automaton()
+        for word in words:
+            automaton.add_word(word, word)
+        automaton.make_automaton()
+        return lambda text: (word for _, word in automaton.iter(text))
+
+    # Fallback: zero-width lookahead so overlapping keywords are still all found
+    alternation = "|".join(re.escape(word) for word in sorted(words, key=len, reverse=True))
+    pattern = re.compile(f"(?=({alternation}))")
+    return lambda text: (match.group(1) for match in pattern.finditer(text))
+
 
 class WeatherExtractor:
+    # Fixed vocabulary, shared by all instances
+    weather_words = (
+        "wetter", "temperatur", "regen", "schnee", "sonne", "wind",
+        "kalt", "warm", "gewitter", "niederschlag", "bewölkt", "wolken",
+        "grad", "celsius", "vorhersage"
+    )
+
+    cities = (
+        "berlin", "hamburg", "münchen", "köln", "frankfurt", "stuttgart",
+        "düsseldorf", "dresden", "leipzig", "hannover", "nürnberg",
+        "dortmund", "essen", "bremen", "bonn", "mannheim", "heilbronn"
+    )
+
+    today_words = ("heute", "jetzt", "aktuell")
+    tomorrow_words = ("morgen",)
+    week_words = ("woche", "tage", "übermorgen")
+
     def __init__(self):
-        self.weather_words = [
-            "wetter", "temperatur", "regen", "schnee", "sonne", "wind",
-            "kalt", "warm", "gewitter", "niederschlag", "bewölkt", "wolken",
-            "grad", "celsius", "vorhersage"
-        ]
-
-        self.cities = [
-            "berlin", "hamburg", "münchen", "köln", "frankfurt", "stuttgart",
-            "düsseldorf", "dresden", "leipzig", "hannover", "nürnberg",
-            "dortmund", "essen", "bremen", "bonn", "mannheim", "heilbronn"
-        ]
-
-        self.today_words = ["heute", "jetzt", "aktuell"]
-        self.tomorrow_words = ["morgen"]
-        self.week_words = ["woche", "tage", "übermorgen"]
+        self.categories = {}
+        for category, words in (("weather", self.weather_words), ("city", self.cities),
+                                ("today", self.today_words), ("tomorrow", self.tomorrow_words),
+                                ("week", self.week_words)):
+            for word in words:
+                self.categories[word] = category
+        self.scan = _keyword_scanner(self.categories)
+        # Anything shorter cannot contain a single keyword
+        self.min_length = min(len(word) for word in self.categories)
+
+    def vocabulary(self):
+        # Every word the rules react to, e.g. for a grammar constrained recognizer
+        return (self.weather_words + self.cities + self.today_words +
+                self.tomorrow_words + self.week_words)
 
     def extract(self, text):
-        if not text:
+        if not text or len(text) < self.min_length:
             return {"is_weather_query": False, "location": None, "time_period": "today"}
 
         text = text.lower()
 
-        is_weather = False
-        for word in self.weather_words:
-            if word in text:
-                is_weather = True
-                break
-
-        # Ort (Stadt) finden
         location = None
-        for city in self.cities:
-            if city in text:
-                location = city
-                is_weather = True
-                break
+        found = set()
+        for word in self.scan(text):
+            category = self.categories[word]
+            found.add(category)
+            # Ort (Stadt) finden
+            if category == "city" and location is None:
+                location = word
 
+        is_weather = "weather" in found or location is not None
 
         if location is None and is_weather:
-            # Muster: "Wetter [Stadt]"
-            pattern = r'wetter\s+([a-zäöüß]+)'
-            match = re.search(pattern, text)
+            match = WETTER_CITY_PATTERN.search(text)
             if match:
                 potential_city = match.group(1)
-                if (potential_city not in self.weather_words and
-                        potential_city not in self.today_words and
-                        potential_city not in self.tomorrow_words and
-                        potential_city not in self.week_words):
+                # Any known keyword here is not a city (known cities were matched above)
+                if potential_city not in self.categories:
                     location = potential_city
 
        ##time
         time_period = "today"
-        for word in self.tomorrow_words:
-            if word in text:
-                time_period = "tomorrow"
-                break
-
-        for word in self.week_words:
-            if word in text:
-                time_period = "week"
-                break
+        if "week" in found:
+            time_period = "week"
+        elif "tomorrow" in found:
+            time_period = "tomorrow"
 
         return {
             "is_weather_query": is_weather,
@@ -0,0 +1,46 @@
+import extractorService
+from extractorService import WeatherExtractor
+
+
+class TestWeatherExtractor:
+
+    def setup_method(self):
+        self.extractor = WeatherExtractor()
+
+    def test_empty(self):
+        result = self.extractor.extract("")
+        assert result == {"is_weather_query": False, "location": None, "time_period": "today"}
+
+    def test_too_short(self):
+        assert self.extractor.min_length == 4
+        assert self.extractor.extract("ja") == self.extractor.extract("")
+
+    def test_city_and_time(self):
+        result = self.extractor.extract("Wie ist das Wetter in Berlin morgen")
+        assert result["is_weather_query"] == True
+        assert result["location"] == "berlin"
+        assert result["time_period"] == "tomorrow"
+
+    def test_unknown_city(self):
+        result = self.extractor.extract("wetter paris")
+        assert result["location"] == "paris"
+        assert result["time_period"] == "today"
+
+    def test_week_overrides_tomorrow(self):
+        # "übermorgen" also contains "morgen"
+        result = self.extractor.extract("wetter übermorgen in bonn")
+        assert result["location"] == "bonn"
+        assert result["time_period"] == "week"
+
+    def test_no_weather(self):
+        result = self.extractor.extract("hallo")
+        assert result["is_weather_query"] == False
+        assert result["location"] is None
+
+    def test_regex_fallback(self, monkeypatch):
+        monkeypatch.setattr(extractorService, "ahocorasick_available", False)
+        extractor = WeatherExtractor()
+
+        texts = ["regen in münchen und hamburg", "die nächsten tage in köln", "temperatur diese woche"]
+        for text in texts:
+            assert extractor.extract(text) == self.extractor.extract(text)
@@ -0,0 +1,22 @@
+# gunicorn -c gunicorn.conf.py controller:app
+#
+# The Vosk model is loaded once in the master before forking. Workers inherit it
+# copy-on-write instead of each loading their own copy, and since Vosk decodes
+# on a single thread, extra worker processes are what use the remaining cores.
+import multiprocessing
+import os
+
+from vosk_service import VoskService
+
+bind = os.environ.get("BIND", "0.0.0.0:8765")
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+# The app sizes its decode thread pool from this, so workers x threads = cores
+os.environ["WEB_CONCURRENCY"] = str(workers)
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = True
+# Let the kernel balance incoming websocket connections across the workers
+reuse_port = True
+
+
+def on_starting(server):
+    VoskService.init_once()
@@ -1,5 +1,39 @@
+"""Development entry point for the voice weather API.
+
+uvicorn picks uvloop and httptools automatically when they are installed
+(uvicorn[standard]), which is noticeably faster for the websocket endpoints.
+For production run several workers, e.g.
+
+    uvicorn controller:app --loop uvloop --http httptools --ws websockets --workers $(nproc)
+
+or use gunicorn.conf.py to share the preloaded Vosk model between workers.
+Terminate TLS in a reverse proxy (nginx, caddy) in front of the workers so
+the CPU stays free for speech recognition.
+"""
+import logging
+import logging.handlers
+import os
+import queue
+
 import uvicorn
 from controller import app
 
+
+def configure_logging():
+    # Records are handed to a listener thread, so writing them never blocks the event loop
+    log_queue = queue.SimpleQueue()
+    logging.basicConfig(
+        level=os.environ.get("LOG_LEVEL", "INFO"),
+        handlers=[logging.handlers.QueueHandler(log_queue)]
+    )
+    listener = logging.handlers.QueueListener(log_queue, logging.StreamHandler())
+    listener.start()
+    return listener
+
+
 if __name__ == "__main__":
-    uvicorn.run(app, host="localhost", port=8765)
+    listener = configure_logging()
+    try:
+        uvicorn.run(app, host="localhost", port=8765)
+    finally:
+        listener.stop()
@@ -1,11 +1,28 @@
 import asyncio
 import json
+import logging
 import os
 import wave
+from collections import deque
 import numpy as np
 import pyaudio
 import websockets
 from datetime import datetime
+from pathlib import Path
+
+try:
+    import webrtcvad
+
+    vad_available = True
+except ImportError:
+    vad_available = False
+
+try:
+    import orjson
+
+    orjson_available = True
+except ImportError:
+    orjson_available = False
 
 from vosk_service import VoskService
 from extractorService import WeatherExtractor
@@ -16,17 +33,36 @@ TRANSCRIBE_TEXT_DIR = "transcribe_text"
 os.makedirs(RECORDINGS_DIR, exist_ok=True)
 os.makedirs(TRANSCRIBE_TEXT_DIR, exist_ok=True)
 
+log = logging.getLogger(__name__)
+
 # Server settings
 WS_HOST = "localhost"
 WS_PORT = 8765
 
-# List of connected clients
-active_connections = set()
+# Connected clients -> their outbound message queue
+active_connections = {}
+
+# Messages a client may fall behind by before it is dropped as too slow
+CLIENT_QUEUE_SIZE = 64
+
+
+def encode_message(message) -> str:
+    # Text frames, the browser client parses them with JSON.parse
+    if orjson_available:
+        return orjson.dumps(message).decode()
+    return json.dumps(message, separators=(",", ":"))
+
+
+# Fixed status messages, encoded once at import
+STATUS_CONNECTED = encode_message({"type": "status", "message": "Connected to Speech-to-Text Service"})
+STATUS_RECORDING_STARTED = encode_message({"type": "status", "message": "Recording started"})
+STATUS_RECORDING_STOPPED = encode_message({"type": "status", "message": "Recording stopped"})
+STATUS_PROCESSING = encode_message({"type": "status", "message": "Processing audio"})
 
 
 class SpeechToTextService:
     def __init__(self, trigger_word="wetter"):
-        print("Starting Speech-to-Text Service")
+        log.info("Starting Speech-to-Text Service")
 
         self.vosk_service = VoskService()
         self.weather_extractor = WeatherExtractor()
@@ -36,52 +72,101 @@ class SpeechToTextService:
         self.FORMAT = pyaudio.paInt16
         self.CHANNELS = 1
         self.RATE = 16000
-        self.CHUNK = 1024
+        # 60 ms, two 30 ms WebRTC VAD frames per chunk
+        self.CHUNK = 960
         self.THRESHOLD = 500
+        # is_voice compares a sum, every callback delivers exactly CHUNK samples
+        self._thresh_sum = self.THRESHOLD * self.CHUNK
+        self._abs_scratch = np.empty(self.CHUNK, dtype=np.int32)
+        # Far fewer false triggers on background noise than the amplitude threshold
+        self.vad = webrtcvad.Vad(3) if vad_available else None
+        self._vad_frame_bytes = self.RATE * 30 // 1000 * 2
 
         self.p = pyaudio.PyAudio()
+        self._sample_width = self.p.get_sample_size(self.FORMAT)
+        self.stream = None
+        # Background file writes, referenced until done so they are not garbage collected
+        self._tasks = set()
 
         self.frames = []
+        # Recognizer state for the current recording, fed chunk by chunk while it is captured
+        self.vosk_session = {}
+        # Separate recognizer that listens for the trigger word between recordings
+        self.trigger_session = {}
+        self.transcript = ""
         self.is_recording = False
         self.triggered = False
         self.trigger_word = trigger_word.lower()
 
-        self.silence_seconds = 1.5
-        self.frames_per_second = int(self.RATE / self.CHUNK)
-        self.silence_frames = int(self.silence_seconds * self.frames_per_second)
+        # Durations are converted to whole chunks from milliseconds; RATE / CHUNK is not an integer
+        self.silence_ms = 1500
+        self.silence_frames = self.RATE * self.silence_ms // (1000 * self.CHUNK)
+        # Audio kept from before the trigger word so the recording starts with it
+        self.buffer_ms = 2000
+        self.buffer_frames = self.RATE * self.buffer_ms // (1000 * self.CHUNK)
 
-        print(f"Ready Listening for trigger word: '{self.trigger_word}'")
+        log.info("Ready Listening for trigger word: '%s'", self.trigger_word)
 
     def setup_microphone(self):
         """Set up the microphone for recording"""
+        # PortAudio delivers chunks from its own thread straight into this queue
+        self._loop = asyncio.get_running_loop()
+        # About five seconds of audio; if the loop falls behind, the oldest chunks go first
+        self._audio_q = asyncio.Queue(maxsize=5 * self.RATE // self.CHUNK)
         return self.p.open(
             format=self.FORMAT,
             channels=self.CHANNELS,
             rate=self.RATE,
             input=True,
-            frames_per_buffer=self.CHUNK
+            frames_per_buffer=self.CHUNK,
+            stream_callback=self._pa_callback,
+            start=True
         )
 
+    def _pa_callback(self, in_data, frame_count, time_info, status):
+        self._loop.call_soon_threadsafe(self._enqueue_audio, in_data)
+        return None, pyaudio.paContinue
+
+    def _enqueue_audio(self, data):
+        # Never block the PortAudio thread, drop stale audio instead
+        if self._audio_q.full():
+            self._audio_q.get_nowait()
+        self._audio_q.put_nowait(data)
+
     def is_voice(self, data):
         """Check if audio contains voice"""
+        if self.vad is not None and len(data) == self.CHUNK * 2:
+            step = self._vad_frame_bytes
+            return any(self.vad.is_speech(data[offset:offset + step], self.RATE)
+                       for offset in range(0, len(data), step))
+
         audio_data = np.frombuffer(data, dtype=np.int16)
-        return np.abs(audio_data).mean() > self.THRESHOLD
+        # Integer sum against THRESHOLD * CHUNK: one int32 pass, no float mean, and
+        # abs(-32768) no longer wraps around as it does in int16
+        if audio_data.size == self.CHUNK:
+            # The abs values land in a reused buffer instead of a fresh array per chunk
+            np.abs(audio_data, dtype=np.int32, out=self._abs_scratch)
+            return self._abs_scratch.sum() > self._thresh_sum
+        # Short or odd sized buffers are judged by their own length, not a full chunk
+        return np.abs(audio_data, dtype=np.int32).sum() > self.THRESHOLD * audio_data.size
 
     def start_recording(self):
         """Start recording audio"""
         self.frames = []
         self.is_recording = True
-        print("Recording started")
+        log.info("Recording started")
 
     def stop_recording(self):
         """Stop recording audio"""
         self.is_recording = False
-        print(f"Recording stopped. Captured {len(self.frames)} frames")
+        log.info("Recording stopped. Captured %d frames", len(self.frames))
 
-    def save_audio(self, filename):
+    def save_audio(self, filename, frames=None):
         """Save recorded audio to file"""
-        if not self.frames:
-            print("No audio to save")
+        if frames is None:
+            frames = self.frames
+        if not frames:
+            log.warning("No audio to save")
             return False
 
         try:
@@ -90,142 +175,153 @@ class SpeechToTextService:
 
             # Set the number of channels, sample width, and frame rate
             wf.setnchannels(self.CHANNELS)
-            wf.setsampwidth(self.p.get_sample_size(self.FORMAT))
-            wf.setframerate(self.RATE)
-            wf.writeframes(b''.join(self.frames))
-            wf.close()
-            return True
-        except Exception as e:
-            print(f"Error saving audio: {e}")
-            return False
-
-    def save_frames_to_file(self, frames, filename):
-        """Save audio frames to a file"""
-        try:
-            wf = wave.open(filename, 'wb')
-            wf.setnchannels(self.CHANNELS)
-            wf.setsampwidth(self.p.get_sample_size(self.FORMAT))
+            wf.setsampwidth(self._sample_width)
             wf.setframerate(self.RATE)
             wf.writeframes(b''.join(frames))
             wf.close()
             return True
         except Exception as e:
-            print(f"Error saving frames: {e}")
+            log.error("Error saving audio: %s", e)
             return False
 
     async def detect_speech(self, stream):
         """Listen for speech and record when detected"""
-        silence_count = 0
-        buffer = []
-        buffer_size = 30  # About 1 second of audio
+        # Counts down to zero over a silent stretch, reset by speech
+        silence_frames = self.silence_frames
+        silence_remaining = silence_frames
+        # Drops the oldest chunk itself once full, without shifting the list
+        buffer = deque(maxlen=self.buffer_frames)
 
-        print("Listening for trigger word...")
+        log.info("Listening for trigger word...")
+
+        listening = self.vosk_service.is_available()
+        if listening:
+            self.vosk_service.start_stream(self.RATE, self.trigger_session)
 
         while True:
             # Read audio from microphone
-            data = await asyncio.to_thread(stream.read, self.CHUNK)
+            data = await self._audio_q.get()
 
             # Add to buffer
             buffer.append(data)
-            if len(buffer) > buffer_size:
-                buffer.pop(0)
 
             # Check if this is speech
             is_speech = self.is_voice(data)
 
             # If not triggered yet, check for trigger word
             if not self.triggered:
-                if is_speech and len(buffer) >= 15:
-                    temp_file = os.path.join(RECORDINGS_DIR, "temp_trigger.wav")
-                    self.save_frames_to_file(buffer, temp_file)
-
-                    # Check for trigger word
-                    result = self.vosk_service.transcribe_audio(temp_file)
-                    if os.path.exists(temp_file):
-                        os.remove(temp_file)
-
-                    if result.get("success") and result.get("text"):
-                        text = result.get("text", "").lower()
-                        if self.trigger_word in text:
-                            print(f"Trigger word detected: '{self.trigger_word}'")
-                            self.triggered = True
-                            self.start_recording()
-
-                            for frame in buffer:
-                                self.frames.append(frame)
-
-                            # Tell clients recording started
-                            await self.send_to_all_clients({
-                                "type": "status",
-                                "message": "Recording started"
-                            })
+                if not listening:
+                    continue
+
+                # Every chunk is fed once, so the recognizer keeps its state between
+                # chunks instead of decoding the whole buffer again
+                partial = self.vosk_service.accept_chunk(data, self.trigger_session)
+                if self.trigger_word in partial["text"].lower():
+                    log.info("Trigger word detected: '%s'", self.trigger_word)
+                    self.triggered = True
+                    silence_remaining = silence_frames
+                    self.start_recording()
+
+                    self.frames.extend(buffer)
+                    self.vosk_service.start_stream(self.RATE, self.vosk_session)
+                    # buffer_ms of audio at once; decode it off the event loop
+                    await asyncio.to_thread(self.vosk_service.accept_chunk, b"".join(buffer), self.vosk_session)
+
+                    # Tell clients recording started
+                    await self.send_to_all_clients(STATUS_RECORDING_STARTED)
+                elif is_speech:
+                    silence_remaining = silence_frames
+                else:
+                    silence_remaining -= 1
+                    # Forget what was said before a pause, the text would only keep growing
+                    if silence_remaining == 0:
+                        self.vosk_service.start_stream(self.RATE, self.trigger_session)
+                        silence_remaining = silence_frames
 
             # If triggered, handle recording
             elif self.triggered:
                 if self.is_recording:
                     self.frames.append(data)
+                    self.vosk_service.accept_chunk(data, self.vosk_session)
 
                 if is_speech:
-                    silence_count = 0
+                    silence_remaining = silence_frames
                 else:
-                    silence_count += 1
-                    if silence_count % 10 == 0:
-                        print(f"Silence: {silence_count}/{self.silence_frames}")
+                    silence_remaining -= 1
+                    if (silence_frames - silence_remaining) % 10 == 0:
+                        # Lazy formatting, costs nothing unless debug logging is on
+                        log.debug("Silence: %d/%d", silence_frames - silence_remaining, silence_frames)
 
                 # Stop after silence threshold reached
-                if silence_count >= self.silence_frames:
-                    print("Silence detected, stopping recording")
+                if silence_remaining == 0:
+                    log.info("Silence detected, stopping recording")
                     self.stop_recording()
+                    self.transcript = await asyncio.to_thread(self.vosk_service.finish_stream, self.vosk_session)
                     self.triggered = False
 
-                    await self.send_to_all_clients({
-                        "type": "status",
-                        "message": "Recording stopped"
-                    })
+                    await self.send_to_all_clients(STATUS_RECORDING_STOPPED)
 
                     return
 
     async def send_to_all_clients(self, message):
-        """Send a message to all connected clients"""
+        """Send a message (dict or already encoded JSON) to all connected clients"""
         if active_connections:
-            message_json = json.dumps(message)
-            await asyncio.gather(
-                *[connection.send(message_json) for connection in active_connections]
-            )
-            print(f"Sent message to {len(active_connections)} clients")
+            if not isinstance(message, str):
+                message = encode_message(message)
+            # One put_nowait per client; each client's sender task does the actual send
+            for websocket, outbox in list(active_connections.items()):
+                try:
+                    outbox.put_nowait(message)
+                except asyncio.QueueFull:
+                    self._drop_slow_client(websocket)
+            log.debug("Sent message to %d clients", len(active_connections))
         else:
-            print("No clients connected")
+            log.debug("No clients connected")
 
     async def handle_client_connection(self, websocket, path):
         """Handle a client connection"""
-        print(f"New client connected: {websocket.remote_address}")
-        active_connections.add(websocket)
+        log.info("New client connected: %s", websocket.remote_address)
+        outbox = asyncio.Queue(maxsize=CLIENT_QUEUE_SIZE)
+        active_connections[websocket] = outbox
+        sender = asyncio.create_task(self._sender_loop(websocket, outbox))
 
         try:
             # Send welcome message
-            await websocket.send(json.dumps({
-                "type": "status",
-                "message": "Connected to Speech-to-Text Service"
-            }))
+            outbox.put_nowait(STATUS_CONNECTED)
 
             # Handle messages from client
             async for message in websocket:
                 try:
-                    data = json.loads(message)
-                    print(f"Received from client: {data}")
+                    # orjson's decode error subclasses json.JSONDecodeError
+                    data = orjson.loads(message) if orjson_available else json.loads(message)
+                    log.debug("Received from client: %s", data)
 
                     # Handle client commands if needed
                     if data.get("command") == "set_city":
                         city = data.get("city", "")
-                        print(f"City set to: {city}")
+                        log.info("City set to: %s", city)
 
                 except json.JSONDecodeError:
-                    print(f"Received invalid message: {message}")
+                    log.warning("Received invalid message: %s", message)
 
         except websockets.exceptions.ConnectionClosed:
-            print(f"Client disconnected: {websocket.remote_address}")
+            log.info("Client disconnected: %s", websocket.remote_address)
         finally:
-            active_connections.remove(websocket)
+            active_connections.pop(websocket, None)
+            sender.cancel()
+
+    async def _sender_loop(self, websocket, outbox):
+        """Send queued messages to one client, in order"""
+        try:
+            while True:
+                await websocket.send(await outbox.get())
+        except websockets.exceptions.ConnectionClosed:
+            return
+
+    def _drop_slow_client(self, websocket):
+        log.warning("Dropping slow client: %s", websocket.remote_address)
+        active_connections.pop(websocket, None)
+        self._background(websocket.close(1013))
 
     async def start_websocket_server(self):
         """Start the WebSocket server"""
@@ -234,95 +330,98 @@ class SpeechToTextService:
             WS_HOST,
             WS_PORT
         )
-        print(f"WebSocket server started at ws://{WS_HOST}:{WS_PORT}")
+        log.info("WebSocket server started at ws://%s:%s", WS_HOST, WS_PORT)
         return server
 
     async def process_speech(self):
         """Main function: record speech, convert to text, extract info"""
         try:
-            stream = self.setup_microphone()
+            # Opened once and kept running; reopening PortAudio per utterance drops frames
+            if self.stream is None:
+                self.stream = self.setup_microphone()
+
+            await self.detect_speech(self.stream)
+
+            # Keep a copy of the recording; the text was already decoded while listening
+            if self.frames:
+                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+                audio_file = os.path.join(RECORDINGS_DIR, f"audio_{timestamp}.wav")
+                # Written by a thread in the background while the text is processed
+                self._background(asyncio.to_thread(self.save_audio, audio_file, self.frames))
+                log.info("Saving audio to: %s", audio_file)
 
-            try:
-                await self.detect_speech(stream)
+                # processing started
+                await self.send_to_all_clients(STATUS_PROCESSING)
 
-                # Save audio file
-                audio_file = None
-                if self.frames:
-                    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                    audio_file = os.path.join(RECORDINGS_DIR, f"audio_{timestamp}.wav")
-                    self.save_audio(audio_file)
-                    print(f"Audio saved to: {audio_file}")
+                if self.transcript:
+                    # Save transcription
+                    text = self.transcript
+                    filepath = os.path.join(TRANSCRIBE_TEXT_DIR, f"transcription_{timestamp}.text")
 
-                    # processing started
+                    # Clients get the text without waiting for the disk
+                    self._background(asyncio.to_thread(Path(filepath).write_text, text, encoding="utf-8"))
+                    log.info("Transcription: '%s'", text)
+
+                    # Send transcription to clients
                     await self.send_to_all_clients({
-                        "type": "status",
-                        "message": "Processing audio"
+                        "type": "transcription",
+                        "text": text
                     })
 
-                # Transcribe audio
-                if audio_file and os.path.exists(audio_file):
-                    print(f"Transcribing audio: {audio_file}")
-                    result = self.vosk_service.transcribe_audio(audio_file)
-
-                    if result.get("success") and result.get("text"):
-                        # Save transcription
-                        text = result["text"]
-                        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                        filepath = os.path.join(TRANSCRIBE_TEXT_DIR, f"transcription_{timestamp}.text")
-
-                        with open(filepath, "w", encoding="utf-8") as file:
-                            file.write(text)
-                        print(f"Transcription: '{text}'")
-
-                        # Send transcription to clients
-                        await self.send_to_all_clients({
-                            "type": "transcription",
-                            "text": text
-                        })
-
-                        # Extract weather info
-                        weather_data = self.weather_extractor.extract(text)
-                        weather_data["original_query"] = text
-                        print(f"Extracted data: {weather_data}")
-
-                        # If it's a weather query, send the location
-                        if weather_data["is_weather_query"]:
-                            location = weather_data.get("location", "")
-                            if location:
-                                await self.send_to_all_clients({
-                                    "type": "city",
-                                    "city": location
-                                })
-
-                                await self.send_to_all_clients({
-                                    "type": "message",
-                                    "text": f"Stadt auf {location} gesetzt. Klicken Sie auf 'Aktualisieren', um die Wetterdaten zu laden."
-                                })
-
-                        return filepath
-                    else:
-                        error_message = "Transcription failed or empty"
-                        print(error_message)
-                        await self.send_to_all_clients({
-                            "type": "error",
-                            "message": error_message
-                        })
-
-                return None
-
-            finally:
-                stream.stop_stream()
-                stream.close()
+                    # Extract weather info
+                    weather_data = self.weather_extractor.extract(text)
+                    weather_data["original_query"] = text
+                    log.debug("Extracted data: %s", weather_data)
+
+                    # If it's a weather query, send the location
+                    if weather_data["is_weather_query"]:
+                        location = weather_data.get("location", "")
+                        if location:
+                            await self.send_to_all_clients({
+                                "type": "city",
+                                "city": location
+                            })
+
+                            await self.send_to_all_clients({
+                                "type": "message",
+                                "text": f"Stadt auf {location} gesetzt. Klicken Sie auf 'Aktualisieren', um die Wetterdaten zu laden."
+                            })
+
+                    return filepath
+                else:
+                    error_message = "Transcription failed or empty"
+                    log.warning(error_message)
+                    await self.send_to_all_clients({
+                        "type": "error",
+                        "message": error_message
+                    })
+
+            return None
 
         except Exception as e:
             error_message = f"Error: {str(e)}"
-            print(error_message)
+            log.error(error_message)
             await self.send_to_all_clients({
                 "type": "error",
                 "message": error_message
             })
             return None
 
+    def _background(self, coro):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def close(self):
+        """Stop the microphone and release PortAudio"""
+        # Let pending recordings finish writing
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self.stream is not None:
+            self.stream.stop_stream()
+            self.stream.close()
+            self.stream = None
+        self.p.terminate()
+
 
 async def main():
     """Main function to start the service"""
@@ -337,12 +436,14 @@ async def main():
             await service.process_speech()
             await asyncio.sleep(1)
     except KeyboardInterrupt:
-        print("Service stopped by user")
+        log.info("Service stopped by user")
     finally:
+        await service.close()
         server.close()
         await server.wait_closed()
-        print("WebSocket server closed")
+        log.info("WebSocket server closed")
 
 
 if __name__ == "__main__":
+    logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO"))
     asyncio.run(main())
@@ -46,6 +46,14 @@ class TestSpeechToText:
         assert self.service.is_recording == False
         assert len(self.service.frames) == 2
 
+    def test_is_voice(self):
+        # Amplitude fallback used without webrtcvad
+        self.service.vad = None
+        silence = np.zeros(960, dtype=np.int16)
+        loud = np.full(960, -32768, dtype=np.int16)
+        assert self.service.is_voice(silence.tobytes()) == False
+        assert self.service.is_voice(loud.tobytes()) == True
+
     def test_save_audio(self, monkeypatch):
         saved_data = {}
 
@@ -1,30 +1,87 @@
+import asyncio
+import io
 import json
+import logging
 import os
+import queue
 import wave
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, Any
 
+log = logging.getLogger(__name__)
+
 try:
     from vosk import Model, KaldiRecognizer, SetLogLevel
 
     vosk_available = True
 except ImportError:
     vosk_available = False
-    print("Warning: Vosk not available")
+    log.warning("Vosk not available")
+
+try:
+    # Recognizer results are parsed several times per utterance
+    from orjson import loads as _loads
+except ImportError:
+    _loads = json.loads
+
+try:
+    import webrtcvad
+
+    vad_available = True
+except ImportError:
+    vad_available = False
+
+try:
+    # Only present in GPU enabled Vosk builds
+    from vosk import BatchModel, BatchRecognizer, GpuInit
+
+    batch_available = True
+except ImportError:
+    batch_available = False
+
+# Frames handed to AcceptWaveform per call. Bigger chunks mean fewer Python <-> C
+# transitions and fewer partly filled nnet3 passes, so better throughput for whole
+# uploads; smaller chunks give earlier partial results (~2000). 8000 is 500 ms at 16 kHz.
+# Live streams are fed as their messages arrive and are not affected.
+VOSK_CHUNK_FRAMES = int(os.environ.get("VOSK_CHUNK_FRAMES", "8000"))
+# Any Vosk model directory works, e.g. one with an int8 quantized nnet3 for faster
+# CPU decoding, without touching the code
+VOSK_MODEL_PATH = os.environ.get("VOSK_MODEL_PATH", "model/vosk-model-small-de-0.15")
+
+# Idle recognizers kept per sample rate for callers without a session
+RECOGNIZER_POOL_SIZE = 8
 
 _vosk_instance = None
 
 
+def strip_unknown(text: str) -> str:
+    # Grammar mode marks out-of-vocabulary words as [unk]
+    return " ".join(word for word in text.split() if word != "[unk]")
+
+
 class VoskService:
-    def __init__(self, model_path="model/vosk-model-small-de-0.15"):
+    CHUNK_FRAMES = VOSK_CHUNK_FRAMES
+
+    def __init__(self, model_path=VOSK_MODEL_PATH):
         global _vosk_instance
         if _vosk_instance is None:
             self.model_path = model_path
             self.model = None
+            self.grammar = None
+            # sample rate -> queue of idle recognizers for callers without a session
+            self._pool = {}
             self.initialize_model()
             _vosk_instance = self
         else:
             self.model_path = _vosk_instance.model_path
             self.model = _vosk_instance.model
+            self.grammar = _vosk_instance.grammar
+            self._pool = _vosk_instance._pool
+
+    @classmethod
+    def init_once(cls, model_path=VOSK_MODEL_PATH):
+        # Called from the gunicorn master so forked workers share the model pages
+        return cls(model_path)
 
     def initialize_model(self) -> bool:
         if not vosk_available:
@@ -34,42 +91,311 @@ class VoskService:
                 # Reduce console output
                 SetLogLevel(-1)
                 self.model = Model(self.model_path)
-                print(f"Vosk model loaded from: {self.model_path}")
+                log.info("Vosk model loaded from: %s", self.model_path)
                 return True
             except Exception as e:
-                print(f"Error loading Vosk model: {e}")
+                log.error("Error loading Vosk model: %s", e)
                 return False
         return False
 
     def is_available(self) -> bool:
         return vosk_available and self.model is not None
 
-    def transcribe_audio(self, audio_file_path: str) -> Dict[str, Any]:
-        if not self.is_available():
-            return {"success": False, "error": "Speech recognition not available"}
+    def set_grammar(self, phrases):
+        # Restrict decoding to a closed vocabulary; "[unk]" absorbs everything else.
+        # Needs a model with a dynamic graph (the small models have one).
+        self.grammar = json.dumps(list(phrases) + ["[unk]"], ensure_ascii=False)
 
+    def create_recognizer(self, rate: int):
+        if self.grammar:
+            return KaldiRecognizer(self.model, rate, self.grammar)
+        return KaldiRecognizer(self.model, rate)
+
+    def get_recognizer(self, rate: int, session: Dict[str, Any] = None):
+        if session is None:
+            # Borrowed from the pool, handed back by release_recognizer
+            try:
+                rec = self._pool_for(rate).get_nowait()
+            except queue.Empty:
+                return self.create_recognizer(rate)
+            rec.Reset()
+            return rec
+
+        # Reuse the caller's recognizer; only rebuild when the sample rate changes
+        if session.get("rec") is None or session.get("rate") != rate:
+            session["rec"] = self.create_recognizer(rate)
+            session["rate"] = rate
+        else:
+            session["rec"].Reset()
+        return session["rec"]
+
+    def release_recognizer(self, rate: int, rec):
         try:
-            wf = wave.open(audio_file_path, "rb")
-            rec = KaldiRecognizer(self.model, wf.getframerate())
+            self._pool_for(rate).put_nowait(rec)
+        except queue.Full:
+            pass
 
-            result = ""
-            while True:
-                data_chunk = wf.readframes(4000)
-                if len(data_chunk) == 0:
-                    break
-                if rec.AcceptWaveform(data_chunk):
-                    part_result = json.loads(rec.Result())
-                    result += part_result.get("text", "") + " "
+    def _pool_for(self, rate: int):
+        pool = self._pool.get(rate)
+        if pool is None:
+            pool = self._pool.setdefault(rate, queue.Queue(RECOGNIZER_POOL_SIZE))
+        return pool
+
+    def transcribe_bytes(self, audio_data: bytes, session: Dict[str, Any] = None) -> Dict[str, Any]:
+        # Parse the WAV container in memory instead of going through a temp file
+        return self.transcribe_audio(io.BytesIO(audio_data), session)
+
+    def iter_transcription(self, audio_file, session: Dict[str, Any] = None):
+        # Yields a "partial" event whenever the hypothesis changes and a "final" one at the end.
+        # One bulk read, the file is closed before decoding and chunks are sliced from memory.
+        with wave.open(audio_file, "rb") as wf:
+            rate = wf.getframerate()
+            pcm = wf.readframes(wf.getnframes())
+        yield from self.iter_pcm_transcription(rate, memoryview(pcm), session)
+
+    def iter_pcm_transcription(self, rate: int, pcm: bytes, session: Dict[str, Any] = None):
+        step = self.CHUNK_FRAMES * 2
+        chunks = (bytes(pcm[offset:offset + step]) for offset in range(0, len(pcm), step))
+        yield from self._decode(rate, chunks, session)
+
+    def transcribe_stream(self, audio_iter, rate: int = 16000, session: Dict[str, Any] = None):
+        # Raw PCM chunks from any iterable (socket reader, microphone); decoding
+        # starts with the first chunk instead of after the whole upload
+        yield from self._decode(rate, audio_iter, session)
+
+    def _decode(self, rate, chunks, session):
+        rec = self.get_recognizer(rate, session)
+
+        # Finished segments, joined once instead of growing a string per segment
+        parts = []
+        last_partial = ""
+        # Audio the recognizer has taken but not yet turned into a finished segment
+        pending = False
+        for data_chunk in chunks:
+            if rec.AcceptWaveform(data_chunk):
+                text = _loads(rec.Result()).get("text", "")
+                if text:
+                    parts.append(text)
+                last_partial = ""
+                pending = False
+            else:
+                pending = True
+                partial = _loads(rec.PartialResult()).get("partial", "")
+                if partial and partial != last_partial:
+                    last_partial = partial
+                    yield {"type": "partial", "text": strip_unknown(" ".join(parts) + " " + partial)}
+
+        # Always flushes the decoder, but when the last chunk closed a segment there is nothing to parse
+        final_result = rec.FinalResult()
+        if pending:
+            text = _loads(final_result).get("text", "")
+            if text:
+                parts.append(text)
+        if session is None:
+            self.release_recognizer(rate, rec)
+
+        yield {"type": "final", "text": strip_unknown(" ".join(parts))}
+
+    def start_stream(self, rate: int, session: Dict[str, Any]):
+        # Live microphone streaming: chunks arrive one websocket message at a time
+        self.get_recognizer(rate, session)
+        session["streaming"] = True
+        session["parts"] = []
+
+    def accept_chunk(self, pcm: bytes, session: Dict[str, Any]) -> Dict[str, Any]:
+        rec = session["rec"]
+        if rec.AcceptWaveform(pcm):
+            text = _loads(rec.Result()).get("text", "")
+            if text:
+                session["parts"].append(text)
+            return {"type": "partial", "text": strip_unknown(" ".join(session["parts"]))}
+
+        partial = _loads(rec.PartialResult()).get("partial", "")
+        return {"type": "partial", "text": strip_unknown(" ".join(session["parts"]) + " " + partial)}
+
+    def finish_stream(self, session: Dict[str, Any]) -> str:
+        session["streaming"] = False
+        text = _loads(session["rec"].FinalResult()).get("text", "")
+        if text:
+            session["parts"].append(text)
+        return strip_unknown(" ".join(session["parts"]))
+
+    def transcribe_audio(self, audio_file, session: Dict[str, Any] = None) -> Dict[str, Any]:
+        return self._transcribe(self.iter_transcription(audio_file, session))
 
-            final_result = json.loads(rec.FinalResult())
-            result += final_result.get("text", "")
+    def transcribe_pcm(self, rate: int, pcm: bytes, session: Dict[str, Any] = None) -> Dict[str, Any]:
+        # Raw 16 bit mono samples, e.g. straight from the microphone buffer
+        return self._transcribe(self.iter_pcm_transcription(rate, pcm, session))
+
+    def transcribe_batch(self, audio_files, max_workers: int = None):
+        """Transcribes several files at once, results in input order.
+
+        Every file gets its own (pooled) recognizer on the shared model; Vosk
+        releases the GIL while decoding, so the threads run in parallel.
+        """
+        audio_files = list(audio_files)
+        if not audio_files:
+            return []
+        workers = max_workers or min(len(audio_files), os.cpu_count() or 1)
+        with ThreadPoolExecutor(workers) as executor:
+            return list(executor.map(self.transcribe_audio, audio_files))
+
+    def _transcribe(self, events) -> Dict[str, Any]:
+        if not self.is_available():
+            return {"success": False, "error": "Speech recognition not available"}
+
+        try:
+            for event in events:
+                pass
 
             return {
                 "success": True,
-                "text": result.strip()
+                "text": event["text"]
             }
         except Exception as e:
             return {
                 "success": False,
                 "error": str(e)
             }
+
+
+def read_wav(audio_data: bytes):
+    with wave.open(io.BytesIO(audio_data), "rb") as wf:
+        return wf.getframerate(), wf.readframes(wf.getnframes())
+
+
+def split_audio_message(audio_data: bytes):
+    """Returns (sample_rate, pcm) for a binary websocket audio message.
+
+    Clients either send a complete WAV file or, preferably, a 4 byte
+    little-endian sample rate followed by raw 16 bit mono PCM.
+    """
+    if audio_data[:4] == b"RIFF":
+        return read_wav(audio_data)
+
+    rate = int.from_bytes(audio_data[:4], "little")
+    if not 8000 <= rate <= 48000:
+        raise ValueError(f"Unsupported sample rate: {rate}")
+    # A view, so the body is only copied chunk by chunk when handed to the recognizer
+    return rate, memoryview(audio_data)[4:]
+
+
+def _voiced_frames(rate: int, pcm, aggressiveness: int):
+    """Returns (verdict per 30 ms frame, frame size in bytes), or (None, 0) when the check cannot be made."""
+    if not vad_available or rate not in (8000, 16000, 32000, 48000):
+        return None, 0
+
+    vad = webrtcvad.Vad(aggressiveness)
+    frame_bytes = rate * 30 // 1000 * 2
+    pcm = memoryview(pcm)
+    voiced = [vad.is_speech(bytes(pcm[offset:offset + frame_bytes]), rate)
+              for offset in range(0, len(pcm) - frame_bytes + 1, frame_bytes)]
+    return voiced, frame_bytes
+
+
+def trim_silence(rate: int, pcm, min_ratio: float = 0.1, padding_ms: int = 300, aggressiveness: int = 2):
+    """One WebRTC VAD pass that both gates and trims an upload before decoding.
+
+    Returns None when less than min_ratio of the frames are voiced, so silent
+    uploads skip the Vosk decode entirely. Otherwise cuts leading and trailing
+    non-speech, keeping padding_ms around the voiced part for word onsets and
+    endings. The audio comes back unchanged when VAD is not available.
+    """
+    pcm = memoryview(pcm)
+    voiced, frame_bytes = _voiced_frames(rate, pcm, aggressiveness)
+    if voiced is None:
+        return pcm
+    if not any(voiced) or sum(voiced) < min_ratio * len(voiced):
+        return None
+
+    padding = rate * padding_ms // 1000 * 2
+    first = voiced.index(True)
+    last = len(voiced) - 1 - voiced[::-1].index(True)
+    start = max(0, first * frame_bytes - padding)
+    end = min(len(pcm), (last + 1) * frame_bytes + padding)
+    return pcm[start:end]
+
+
+class BatchedDecoder:
+    """Decodes utterances from all connections through one shared BatchModel.
+
+    A single worker task feeds one chunk per pending utterance into the batch
+    and waits for the whole batch once, so N concurrent streams cost one
+    decoder step instead of N serialized KaldiRecognizer runs.
+    """
+
+    def __init__(self, model_path: str, chunk_bytes: int = VOSK_CHUNK_FRAMES * 2):
+        GpuInit()
+        self.model = BatchModel(model_path)
+        self.chunk_bytes = chunk_bytes
+        self.queue = asyncio.Queue()
+
+    async def transcribe(self, rate: int, pcm) -> Dict[str, Any]:
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((rate, pcm, future))
+        return await future
+
+    async def run(self):
+        jobs = []
+        while True:
+            if not jobs:
+                self._add_job(jobs, *await self.queue.get())
+            while not self.queue.empty():
+                self._add_job(jobs, *self.queue.get_nowait())
+            if not jobs:
+                continue
+
+            try:
+                await asyncio.to_thread(self._step, jobs)
+            except Exception as e:
+                for job in jobs:
+                    if not job["future"].done():
+                        job["future"].set_result({"success": False, "error": str(e)})
+                jobs = []
+                continue
+
+            for job in [job for job in jobs if job["finished"]]:
+                jobs.remove(job)
+                if not job["future"].done():
+                    text = " ".join(part for part in job["parts"] if part)
+                    job["future"].set_result({"success": True, "text": text.strip()})
+
+    def _add_job(self, jobs, rate, pcm, future):
+        # A bad request (e.g. unsupported rate) fails its own caller, not the worker loop
+        try:
+            jobs.append(self._start_job(rate, pcm, future))
+        except Exception as e:
+            if not future.done():
+                future.set_result({"success": False, "error": str(e)})
+
+    def _start_job(self, rate, pcm, future):
+        return {
+            "rec": BatchRecognizer(self.model, rate),
+            "pcm": memoryview(pcm),
+            "offset": 0,
+            "parts": [],
+            "finishing": False,
+            "finished": False,
+            "future": future
+        }
+
+    def _step(self, jobs):
+        for job in jobs:
+            if job["offset"] < len(job["pcm"]):
+                end = job["offset"] + self.chunk_bytes
+                job["rec"].AcceptWaveform(bytes(job["pcm"][job["offset"]:end]))
+                job["offset"] = end
+            elif not job["finishing"]:
+                job["rec"].FinishStream()
+                job["finishing"] = True
+
+        self.model.Wait()
+
+        for job in jobs:
+            while True:
+                result = job["rec"].Result()
+                if not result:
+                    break
+                job["parts"].append(_loads(result).get("text", ""))
+            if job["finishing"]:
+                job["finished"] = True
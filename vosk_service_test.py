@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+
+import vosk_service
+from vosk_service import trim_silence
+
+
+RATE = 16000
+PADDING_MS = 300
+# One 30 ms VAD frame, in samples
+FRAME = RATE * 30 // 1000
+
+
+def silence(seconds):
+    return np.zeros(int(RATE * seconds), dtype=np.int16)
+
+
+def voice(seconds):
+    # 300 Hz tone with a 5 Hz envelope, which WebRTC VAD takes for speech
+    t = np.arange(int(RATE * seconds)) / RATE
+    return (8000 * np.sin(2 * np.pi * 300 * t) * (1 + np.sin(2 * np.pi * 5 * t)) / 2).astype(np.int16)
+
+
+@pytest.mark.skipif(not vosk_service.vad_available, reason="webrtcvad not installed")
+class TestTrimSilence:
+
+    def test_silence(self):
+        assert trim_silence(RATE, silence(2).tobytes()) is None
+
+    def test_voice_keeps_padding(self):
+        pcm = np.concatenate([silence(1), voice(1), silence(1)])
+        trimmed = np.frombuffer(trim_silence(RATE, pcm.tobytes(), padding_ms=PADDING_MS), dtype=np.int16)
+
+        assert len(trimmed) < len(pcm)
+        # All of the voiced part survives, with about padding_ms of silence on either side
+        voiced = np.flatnonzero(trimmed)
+        padding = RATE * PADDING_MS // 1000
+        assert voiced[0] >= padding - FRAME
+        assert len(trimmed) - 1 - voiced[-1] >= padding - FRAME
+        assert np.count_nonzero(trimmed) == np.count_nonzero(pcm)
+
+    def test_unsupported_rate(self):
+        pcm = silence(1).tobytes()
+        assert bytes(trim_silence(11025, pcm)) == pcm
+
+    def test_shorter_than_a_frame(self):
+        assert trim_silence(RATE, voice(0.01).tobytes()) is None
+
+
+def test_without_vad(monkeypatch):
+    monkeypatch.setattr(vosk_service, "vad_available", False)
+    pcm = silence(1).tobytes()
+    assert bytes(trim_silence(RATE, pcm)) == pcm
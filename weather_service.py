@@ -1,29 +1,166 @@
-import requests
+import asyncio
+import logging
+import time
+import httpx
+from collections import OrderedDict
+from urllib.parse import quote
 from typing import Dict, Any
 
+log = logging.getLogger(__name__)
+
+# Gateway errors worth another attempt; the lookup is a plain GET, so repeating it is safe
+RETRY_STATUSES = (502, 503, 504)
+BACKEND_RETRIES = 2
+RETRY_BACKOFF = 0.3
+
+
+class ResponseCache:
+    """Least recently used cache whose entries also expire after ttl seconds.
+
+    For stale_ttl seconds after expiring an entry is still served as "stale"
+    while the caller refreshes it. Expired entries are kept until evicted,
+    together with the HTTP validators (ETag, Last-Modified) they were stored
+    with, so they can be revalidated.
+    """
+
+    def __init__(self, max_size: int = 1024, ttl: float = 60, stale_ttl: float = 0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        # key -> (expires_at, value, validators), oldest use first
+        self._entries = OrderedDict()
+
+    def lookup(self, key):
+        """Returns (value, state), state being "fresh", "stale" or None for a miss."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None, None
+        # Seconds since the entry expired, negative while it is still fresh
+        overdue = time.monotonic() - entry[0]
+        if overdue >= self.stale_ttl:
+            return None, None
+        self._entries.move_to_end(key)
+        return entry[1], "fresh" if overdue < 0 else "stale"
+
+    def get_stale(self, key):
+        """Returns (value, validators) of an entry whether or not it is still fresh."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None, {}
+        return entry[1], entry[2]
+
+    def set(self, key, value, validators=None):
+        self._entries[key] = (time.monotonic() + self.ttl, value, validators or {})
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def refresh(self, key):
+        # The backend confirmed the entry is unchanged
+        value, validators = self.get_stale(key)
+        self.set(key, value, validators)
+
+    def __len__(self):
+        return len(self._entries)
+
 
 class WeatherService:
-    def __init__(self, api_url: str = "http://localhost:8080/api/weather"):
+    def __init__(self, api_url: str = "http://localhost:8080/api/weather", cache_ttl: float = 60,
+                 cache_size: int = 1024, cache_stale_ttl: float = 240):
         self.api_url = api_url
+        # The city is appended as its own path segment
+        self._weather_url = api_url if api_url.endswith("/") else api_url + "/"
+        # Clients poll the same cities over and over
+        self.cache = ResponseCache(cache_size, cache_ttl, cache_stale_ttl)
+        self.stats = {"hits": 0, "misses": 0, "stale": 0}
+        # cache key -> task of the backend call currently running for it
+        self._inflight = {}
+        # One pooled client for the whole process so backend connections are kept alive.
+        # The transport retries failed connection attempts (refused, reset) twice.
+        transport = httpx.AsyncHTTPTransport(
+            retries=2,
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=32, keepalive_expiry=30)
+        )
+        self.client = httpx.AsyncClient(
+            transport=transport,
+            timeout=httpx.Timeout(5.0, connect=2.0),
+            headers={"Accept": "application/json"}
+        )
 
-    def get_weather(self, weather_data):
-        try:
-            import requests
+    async def get_weather(self, weather_data):
+        # The extractor reports an unrecognised city as None
+        location = str(weather_data.get("location") or "Heilbronn")
+        # Umlauts, spaces or "/" in a city name must not change the path
+        url = self._weather_url + quote(location, safe="")
 
-            location = weather_data.get("location", "Heilbronn")
-            url = f"{self.api_url}{location}"
+        # The backend response only depends on the city, whatever its spelling case
+        cache_key = location.strip().lower()
+        cached, state = self.cache.lookup(cache_key)
+        if state == "fresh":
+            self.stats["hits"] += 1
+            return cached
+        if state == "stale":
+            # Answer right away and refresh behind the caller's back
+            self.stats["stale"] += 1
+            self._start_fetch(url, cache_key)
+            return cached
+
+        self.stats["misses"] += 1
+        # A cancelled caller must not cancel the call the others are waiting on
+        return await asyncio.shield(self._start_fetch(url, cache_key))
+
+    def _start_fetch(self, url, cache_key):
+        # Concurrent requests for the same city share one backend call
+        task = self._inflight.get(cache_key)
+        if task is None:
+            task = asyncio.create_task(self._fetch(url, cache_key))
+            self._inflight[cache_key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(cache_key, None))
+        return task
+
+    async def _fetch(self, url, cache_key):
+        try:
+            log.debug("Requesting weather data from: %s", url)
 
-            print(f"Requesting weather data from: {url}")
+            # An expired entry is revalidated; a 304 answer carries no body to parse
+            stale, validators = self.cache.get_stale(cache_key)
+            headers = {}
+            if stale is not None:
+                if "etag" in validators:
+                    headers["If-None-Match"] = validators["etag"]
+                if "last-modified" in validators:
+                    headers["If-Modified-Since"] = validators["last-modified"]
 
-            response = requests.get(url)
-            print(f"Backend response status: {response.status_code}")
+            for attempt in range(BACKEND_RETRIES + 1):
+                response = await self.client.get(url, headers=headers)
+                log.debug("Backend response status: %s", response.status_code)
+                if response.status_code not in RETRY_STATUSES or attempt == BACKEND_RETRIES:
+                    break
+                await asyncio.sleep(RETRY_BACKOFF * 2 ** attempt)
 
+            if response.status_code == 304 and stale is not None:
+                self.cache.refresh(cache_key)
+                return stale
             if response.status_code == 200:
-                return {"success": True, "data": response.json()}
+                result = {"success": True, "data": response.json()}
+                validators = {name: response.headers[name] for name in ("etag", "last-modified")
+                              if name in response.headers}
+                self.cache.set(cache_key, result, validators)
+                return result
             else:
-                print(f"Backend error response: {response.text}")
+                log.warning("Backend error response: %s", response.text)
                 return {"success": False, "message": f"Backend error: {response.status_code}"}
+        except httpx.TimeoutException as e:
+            log.warning("Weather backend timed out: %r", e)
+            return {"success": False, "message": "timeout"}
         except Exception as e:
-            print(f"Error fetching weather data: {e}")
+            log.error("Error fetching weather data: %s", e)
             return {"success": False, "message": f"Error: {str(e)}"}
 
+    async def aclose(self):
+        # Background refreshes still hold the client; stop them before closing it
+        tasks = list(self._inflight.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await self.client.aclose()
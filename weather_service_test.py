@@ -0,0 +1,128 @@
+import asyncio
+import types
+
+import httpx
+
+import weather_service
+from weather_service import WeatherService
+
+
+class TestWeatherService:
+
+    def setup_method(self):
+        self.now = 1000.0
+        self.requests = []
+        # Responses handed out in order; the last one repeats
+        self.responses = [httpx.Response(200, json={"response": "sonnig"})]
+
+    async def make_service(self, monkeypatch):
+        # Only the cache's clock: the event loop still needs the real time.monotonic
+        monkeypatch.setattr(weather_service, "time", types.SimpleNamespace(monotonic=lambda: self.now))
+        monkeypatch.setattr(weather_service, "RETRY_BACKOFF", 0)
+
+        async def handler(request):
+            self.requests.append(request)
+            # Gives concurrent lookups a chance to pile up on the same call
+            await asyncio.sleep(0.01)
+            return self.responses.pop(0) if len(self.responses) > 1 else self.responses[0]
+
+        service = WeatherService(cache_ttl=60, cache_stale_ttl=240)
+        # Close the pooled client the service built before swapping in the mock
+        await service.client.aclose()
+        service.client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        return service
+
+    def run(self, coro):
+        return asyncio.run(coro)
+
+    def test_fresh_stale_miss(self, monkeypatch):
+        async def scenario():
+            service = await self.make_service(monkeypatch)
+            first = await service.get_weather({"location": "Berlin"})
+            assert first == {"success": True, "data": {"response": "sonnig"}}
+            assert await service.get_weather({"location": "berlin"}) == first
+            assert len(self.requests) == 1
+
+            # Expired but within the stale window: old answer now, refresh behind it
+            self.now += 61
+            self.responses = [httpx.Response(200, json={"response": "regen"})]
+            assert await service.get_weather({"location": "Berlin"}) == first
+            await asyncio.gather(*service._inflight.values())
+            assert len(self.requests) == 2
+            assert (await service.get_weather({"location": "Berlin"}))["data"] == {"response": "regen"}
+
+            # Past the stale window: the caller waits for the backend
+            self.now += 301
+            self.responses = [httpx.Response(200, json={"response": "schnee"})]
+            assert (await service.get_weather({"location": "Berlin"}))["data"] == {"response": "schnee"}
+            assert len(self.requests) == 3
+            assert service.stats == {"hits": 2, "misses": 2, "stale": 1}
+            await service.aclose()
+
+        self.run(scenario())
+
+    def test_not_modified(self, monkeypatch):
+        async def scenario():
+            service = await self.make_service(monkeypatch)
+            self.responses = [
+                httpx.Response(200, json={"response": "sonnig"}, headers={"ETag": '"v1"'}),
+                httpx.Response(304),
+            ]
+            first = await service.get_weather({"location": "Bonn"})
+
+            self.now += 400
+            assert await service.get_weather({"location": "Bonn"}) == first
+            assert self.requests[1].headers["If-None-Match"] == '"v1"'
+
+            # The revalidated entry is fresh again
+            assert await service.get_weather({"location": "Bonn"}) == first
+            assert len(self.requests) == 2
+            await service.aclose()
+
+        self.run(scenario())
+
+    def test_concurrent_lookups_share_one_call(self, monkeypatch):
+        async def scenario():
+            service = await self.make_service(monkeypatch)
+            results = await asyncio.gather(*(service.get_weather({"location": "Köln"}) for _ in range(5)))
+            assert len(self.requests) == 1
+            assert all(result == results[0] for result in results)
+            assert self.requests[0].url.raw_path == b"/api/weather/K%C3%B6ln"
+            await service.aclose()
+
+        self.run(scenario())
+
+    def test_retries_gateway_errors(self, monkeypatch):
+        async def scenario(status):
+            service = await self.make_service(monkeypatch)
+            self.requests = []
+            self.responses = [httpx.Response(status)]
+            result = await service.get_weather({"location": "Ulm"})
+            assert result == {"success": False, "message": f"Backend error: {status}"}
+            assert len(self.requests) == weather_service.BACKEND_RETRIES + 1
+            await service.aclose()
+
+        for status in (502, 503, 504):
+            self.run(scenario(status))
+
+    def test_retry_recovers(self, monkeypatch):
+        async def scenario():
+            service = await self.make_service(monkeypatch)
+            self.responses = [httpx.Response(503), httpx.Response(200, json={"response": "sonnig"})]
+            result = await service.get_weather({"location": "Ulm"})
+            assert result["success"] == True
+            assert len(self.requests) == 2
+            await service.aclose()
+
+        self.run(scenario())
+
+    def test_no_retry_on_not_found(self, monkeypatch):
+        async def scenario():
+            service = await self.make_service(monkeypatch)
+            self.responses = [httpx.Response(404)]
+            result = await service.get_weather({"location": "Atlantis"})
+            assert result == {"success": False, "message": "Backend error: 404"}
+            assert len(self.requests) == 1
+            await service.aclose()
+
+        self.run(scenario())